@@ -1,34 +1,72 @@
 from flask import Flask, render_template, request, redirect, url_for, jsonify
-from rdbms import Database, SQLParser, Column
+from rdbms import Database, SQLParser, Column, Replica
 import os
 
 app = Flask(__name__)
 
 DB_FILE = 'webapp.db'
+LOG_FILE = 'webapp.log'
+CACHE_BYTES = 4 * 1024 * 1024
+IS_REPLICA = os.environ.get('RDBMS_REPLICA') == '1'
 
-if os.path.exists(DB_FILE):
-    db = Database.load(DB_FILE)
+if IS_REPLICA:
+    # Followers start from the primary's last save and replay its log; they only answer reads
+    replica = Replica(DB_FILE, LOG_FILE, cache_bytes=CACHE_BYTES)
+    replica.start()
+    parser = replica
 else:
-    db = Database("webapp")
-    parser = SQLParser(db)
-    parser.parse_and_execute("""
-        CREATE TABLE users (
-            id INT PRIMARY KEY,
-            name VARCHAR(100) NOT NULL,
-            email VARCHAR(100) UNIQUE
-        )
-    """)
-    parser.parse_and_execute("""
-        CREATE TABLE tasks (
-            id INT PRIMARY KEY,
-            user_id INT NOT NULL,
-            title VARCHAR(200) NOT NULL,
-            completed BOOLEAN
-        )
-    """)
-    db.save(DB_FILE)
+    replica = None
+    if os.path.exists(DB_FILE):
+        db = Database.load(DB_FILE, lazy=True)
+        db.enable_replication(LOG_FILE)
+        # Records already in webapp.db don't need replaying, so each start drops them from the log
+        db.trim_log()
+    else:
+        db = Database("webapp")
+        db.enable_replication(LOG_FILE)
+        parser = SQLParser(db)
+        parser.parse_and_execute("""
+            CREATE TABLE users (
+                id INT PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                email VARCHAR(100) UNIQUE
+            )
+        """)
+        parser.parse_and_execute("""
+            CREATE TABLE tasks (
+                id INT PRIMARY KEY,
+                user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                title VARCHAR(200) NOT NULL,
+                completed BOOLEAN
+            )
+        """)
+        db.save(DB_FILE)
+
+    parser = SQLParser(db, cache_bytes=CACHE_BYTES)
+
+    if not db.get_table('tasks').foreign_keys:
+        # Older databases never checked task.user_id, so drop tasks whose user is gone before adding the key
+        users_table = db.get_table('users')
+        orphans = [row['id'] for row in db.get_table('tasks').rows.values()
+                   if not users_table.lookup('id', row['user_id'])]
+        try:
+            for task_id in orphans:
+                parser.parse_and_execute("DELETE FROM tasks WHERE id=?", (task_id,))
+            if orphans:
+                app.logger.warning(f"Deleted {len(orphans)} task(s) whose user no longer exists: {orphans}")
+            parser.parse_and_execute(
+                "ALTER TABLE tasks ADD FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE"
+            )
+            db.save(DB_FILE)
+        except ValueError as e:
+            app.logger.error(f"Could not add foreign key on tasks.user_id: {e}")
 
-parser = SQLParser(db)
+    if 'users_with_tasks' not in db.views:
+        parser.parse_and_execute(
+            "CREATE MATERIALIZED VIEW users_with_tasks AS "
+            "SELECT users.id, users.name, tasks.title FROM users JOIN tasks ON users.id=tasks.user_id"
+        )
+        db.save(DB_FILE)
 
 @app.route('/')
 def index():
@@ -66,7 +104,6 @@ def update_user(user_id):
 @app.route('/users/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
     try:
-        parser.parse_and_execute(f"DELETE FROM tasks WHERE user_id={user_id}")
         parser.parse_and_execute(f"DELETE FROM users WHERE id={user_id}")
         db.save(DB_FILE)
         return jsonify({"message": "User deleted"})
@@ -77,7 +114,7 @@ def delete_user(user_id):
 def get_tasks():
     user_id = request.args.get('user_id')
     if user_id:
-        result = parser.parse_and_execute(f"SELECT * FROM tasks WHERE user_id={user_id}")
+        result = parser.parse_and_execute("SELECT * FROM tasks WHERE user_id=?", (int(user_id),))
     else:
         result = parser.parse_and_execute("SELECT * FROM tasks")
     return jsonify(result)
@@ -119,10 +156,23 @@ def delete_task(task_id):
 
 @app.route('/users-with-tasks', methods=['GET'])
 def get_users_with_tasks():
-    result = parser.parse_and_execute(
-        "SELECT users.id, users.name, tasks.title FROM users JOIN tasks ON users.id=tasks.user_id"
-    )
+    result = parser.parse_and_execute("SELECT * FROM users_with_tasks")
     return jsonify(result)
 
+@app.route('/cache-stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(parser.cache_stats())
+
+@app.route('/load-stats', methods=['GET'])
+def get_load_stats():
+    # A replica swaps in a new database when it reloads the snapshot
+    return jsonify((replica.db if replica else db).load_stats)
+
+@app.route('/replication', methods=['GET'])
+def get_replication():
+    if replica is None:
+        return jsonify({"role": "primary", "lsn": db.lsn})
+    return jsonify({"role": "replica", **replica.lag()})
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
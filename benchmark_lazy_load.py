@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Benchmark comparing eager and lazy database startup
+Builds a database with several tables, saves it, then measures how long
+each load mode takes to answer its first query against one table
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from rdbms import Database, SQLParser
+
+TABLES = 8
+ROWS_PER_TABLE = 20000
+
+def build_database(filepath):
+    db = Database("bench")
+    parser = SQLParser(db)
+    for t in range(TABLES):
+        parser.parse_and_execute(
+            f"CREATE TABLE table{t} (id INT PRIMARY KEY, name VARCHAR(50), score INT)"
+        )
+        table = db.get_table(f"table{t}")
+        for i in range(ROWS_PER_TABLE):
+            table.insert({'id': i, 'name': f"row{i}", 'score': i % 100})
+    db.save(filepath)
+
+def time_to_first_query(filepath, lazy, use_mmap=False):
+    start = time.perf_counter()
+    db = Database.load(filepath, lazy=lazy, use_mmap=use_mmap)
+    opened = time.perf_counter() - start
+    SQLParser(db).parse_and_execute("SELECT * FROM table0 WHERE id=42")
+    first_query = time.perf_counter() - start
+    return opened, first_query, len(db.load_stats['tables'])
+
+def run_benchmark():
+    print("=" * 60)
+    print(f"Lazy vs eager load: {TABLES} tables x {ROWS_PER_TABLE} rows")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filepath = os.path.join(tmp, 'bench.db')
+        build_database(filepath)
+        print(f"Database file: {os.path.getsize(filepath) / 1024 / 1024:.1f} MB\n")
+
+        print(f"{'mode':<12}{'open (ms)':>12}{'first query (ms)':>20}{'tables read':>14}")
+        for label, lazy, use_mmap in (('eager', False, False), ('lazy', True, False), ('lazy+mmap', True, True)):
+            opened, first_query, loaded = time_to_first_query(filepath, lazy, use_mmap)
+            print(f"{label:<12}{opened * 1000:>12.1f}{first_query * 1000:>20.1f}{loaded:>14}")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        ROWS_PER_TABLE = int(sys.argv[1])
+    run_benchmark()
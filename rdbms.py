@@ -1,16 +1,30 @@
 import re
+import json
 import pickle
 import os
+import sys
+import time
+import zlib
+import mmap
+import threading
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Tuple
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, ChainMap
+
+FILE_MAGIC = b'RDBMS2\n'
+_load_lock = threading.RLock()
 
 class Column:
-    def __init__(self, name: str, dtype: str, primary_key: bool = False, unique: bool = False, nullable: bool = True):
+    def __init__(self, name: str, dtype: str, primary_key: bool = False, unique: bool = False, nullable: bool = True,
+                 references: Tuple[str, str] = None, on_delete: str = 'RESTRICT'):
         self.name = name
         self.dtype = dtype.upper()
         self.primary_key = primary_key
         self.unique = unique
         self.nullable = nullable if not primary_key else False
+        self.references = references    # (table, column)
+        self.on_delete = on_delete.upper()
     
     def validate(self, value):
         if value is None:
@@ -52,15 +66,52 @@ class BTreeIndex:
             if not self.index[key]:
                 del self.index[key]
 
+class Condition:
+    # A parsed WHERE predicate; a class rather than a closure so views holding one can be pickled
+    def __init__(self, col: str, op: str, val: str):
+        self.col = col
+        self.op = op
+        self.val = val
+        self.index_key = (col, val) if op == '=' else None
+    
+    def __call__(self, row):
+        col, op, val = self.col, self.op, self.val
+        row_val = row.get(col)
+        if row_val is None:
+            return False
+        try:
+            if isinstance(row_val, bool):
+                val_typed = val.upper() in ('TRUE', '1', 'YES')
+            elif isinstance(row_val, (int, float)):
+                try:
+                    val_typed = type(row_val)(val)
+                except:
+                    val_typed = val
+            else:
+                val_typed = val
+            
+            if op == '=': return row_val == val_typed
+            elif op == '!=': return row_val != val_typed
+            elif op == '>': return row_val > val_typed
+            elif op == '<': return row_val < val_typed
+            elif op == '>=': return row_val >= val_typed
+            elif op == '<=': return row_val <= val_typed
+        except:
+            return False
+
 class Table:
     def __init__(self, name: str, columns: List[Column]):
         self.name = name
         self.columns = {col.name: col for col in columns}
-        self.rows = []
+        self.rows = {}
         self.next_id = 0
         self.indexes = {}
         self.primary_key_col = None
         self.unique_cols = []
+        self.listeners = []
+        self.version = 0
+        self.foreign_keys = []      # (column, parent table, parent column)
+        self.referenced_by = []     # (child table, child column, parent column, on delete)
         
         for col in columns:
             if col.primary_key:
@@ -70,6 +121,151 @@ class Table:
                 self.unique_cols.append(col.name)
                 self.indexes[col.name] = BTreeIndex()
     
+    def __setstate__(self, state):
+        # Databases pickled before rows were keyed by _id stored them as a list
+        self.__dict__.update(state)
+        if isinstance(self.rows, list):
+            self.rows = {row['_id']: row for row in self.rows}
+        self.__dict__.setdefault('listeners', [])
+        self.__dict__.setdefault('version', 0)
+        self.__dict__.setdefault('foreign_keys', [])
+        self.__dict__.setdefault('referenced_by', [])
+    
+    def __getstate__(self):
+        self.materialize()
+        return self.__dict__
+    
+    def __getattr__(self, name):
+        # rows and indexes are only missing while a lazily opened table hasn't been read yet.
+        # Another thread may be loading it, so wait on the lock and look again
+        if name in ('rows', 'indexes'):
+            with _load_lock:
+                self.materialize()
+                if name in self.__dict__:
+                    return self.__dict__[name]
+        raise AttributeError(name)
+    
+    def defer(self, loader: 'TableLoader'):
+        self.__dict__.pop('rows', None)
+        self.__dict__.pop('indexes', None)
+        self._loader = loader
+    
+    def materialize(self):
+        with _load_lock:
+            loader = self.__dict__.get('_loader')
+            if loader is not None:
+                loader.load(self)
+                del self.__dict__['_loader']
+    
+    def detach_data(self):
+        # Swaps the rows out so the catalog can be pickled without them
+        if '_loader' in self.__dict__:
+            loader = self.__dict__.pop('_loader')
+            self.rows, self.indexes = {}, {}
+            return loader
+        data = (self.rows, self.indexes)
+        self.rows = {}
+        self.indexes = {col_name: BTreeIndex() for col_name in self.indexes}
+        return data
+    
+    def attach_data(self, data):
+        if isinstance(data, tuple):
+            self.rows, self.indexes = data
+        else:
+            self.defer(data)
+    
+    def create_index(self, col_name: str):
+        if col_name not in self.columns:
+            raise ValueError(f"Column {col_name} does not exist in {self.name}")
+        if col_name in self.indexes:
+            return
+        index = BTreeIndex()
+        for row in self.rows.values():
+            if row[col_name] is not None:
+                index.insert(row[col_name], row['_id'])
+        self.indexes[col_name] = index
+    
+    def lookup(self, col_name: str, value) -> List[Dict]:
+        if col_name in self.indexes:
+            return [self.rows[row_id] for row_id in self.indexes[col_name].search(value)]
+        return [row for row in self.rows.values() if row[col_name] == value]
+    
+    def _scan(self, where: callable = None) -> List[Dict]:
+        # Equality predicates on an indexed column only visit the matching rows
+        rows = self.rows.values()
+        hint = getattr(where, 'index_key', None)
+        if hint and hint[0] in self.indexes:
+            col_name, value = hint
+            try:
+                key = self.columns[col_name].validate(value)
+            except (ValueError, TypeError):
+                key = None
+            if key is not None:
+                rows = self.lookup(col_name, key)
+        return [row for row in rows if where is None or where(row)]
+    
+    def _check_parent(self, col_name: str, value):
+        for fk_col, parent, parent_col in self.foreign_keys:
+            if fk_col == col_name and value is not None and not parent.lookup(parent_col, value):
+                raise ValueError(f"Foreign key violation: {col_name}={value} not found in {parent.name}.{parent_col}")
+    
+    def _check_delete(self, rows: List[Dict], seen: set = None):
+        # Walk the whole cascade before deleting anything so a RESTRICT anywhere leaves every table untouched
+        seen = set() if seen is None else seen
+        rows = [row for row in rows if (self.name, row['_id']) not in seen]
+        seen.update((self.name, row['_id']) for row in rows)
+        for child, child_col, parent_col, on_delete in self.referenced_by:
+            for row in rows:
+                if row[parent_col] is None:
+                    continue
+                children = child.lookup(child_col, row[parent_col])
+                if children and on_delete == 'RESTRICT':
+                    raise ValueError(f"Cannot delete from {self.name}: row is referenced by {child.name}.{child_col}")
+                child._check_delete(children, seen)
+    
+    def _delete_rows(self, rows: List[Dict]):
+        for row in rows:
+            if row['_id'] not in self.rows:
+                continue
+            self._remove_row(row)
+            self._notify(row, None)
+            for child, child_col, parent_col, on_delete in self.referenced_by:
+                if on_delete == 'CASCADE' and row[parent_col] is not None:
+                    child._delete_rows(child.lookup(child_col, row[parent_col]))
+    
+    def _notify(self, old_row: Optional[Dict], new_row: Optional[Dict]):
+        for listener in self.listeners:
+            listener.on_change(self, old_row, new_row)
+    
+    def _store_row(self, row: Dict):
+        self.rows[row['_id']] = row
+        for col_name in self.indexes:
+            if row[col_name] is not None:
+                self.indexes[col_name].insert(row[col_name], row['_id'])
+    
+    def _unstore_row(self, row: Dict):
+        for col_name in self.indexes:
+            if row[col_name] is not None:
+                self.indexes[col_name].delete(row[col_name], row['_id'])
+        del self.rows[row['_id']]
+    
+    def _remove_row(self, row: Dict):
+        self._unstore_row(row)
+        self.version += 1
+    
+    def _apply_changes(self, row: Dict, changes: Dict[str, Any]):
+        # Rows are updated in place so they keep their position in self.rows
+        for col_name, new_val in changes.items():
+            if col_name in self.indexes:
+                if row[col_name] is not None:
+                    self.indexes[col_name].delete(row[col_name], row['_id'])
+                if new_val is not None:
+                    self.indexes[col_name].insert(new_val, row['_id'])
+        row.update(changes)
+    
+    def _is_duplicate(self, col_name: str, value) -> bool:
+        return bool(self.indexes[col_name].search(value))
+    
     def insert(self, values: Dict[str, Any]) -> int:
         row = {'_id': self.next_id}
         
@@ -78,98 +274,810 @@ class Table:
             validated = col.validate(value)
             
             if col.primary_key or col.unique:
-                if validated is not None and self.indexes[col_name].search(validated):
+                if validated is not None and self._is_duplicate(col_name, validated):
                     raise ValueError(f"Duplicate value for {col_name}")
+            self._check_parent(col_name, validated)
             
             row[col_name] = validated
         
-        self.rows.append(row)
-        
-        for col_name in self.indexes:
-            if row[col_name] is not None:
-                self.indexes[col_name].insert(row[col_name], self.next_id)
-        
+        self._store_row(row)
         self.next_id += 1
+        self.version += 1
+        self._notify(None, row)
         return self.next_id - 1
     
     def select(self, columns: List[str] = None, where: callable = None) -> List[Dict]:
         results = []
-        for row in self.rows:
-            if where is None or where(row):
-                if columns:
-                    results.append({k: row[k] for k in columns if k in row})
-                else:
-                    results.append({k: v for k, v in row.items() if k != '_id'})
+        for row in self._scan(where):
+            if columns:
+                results.append({k: row[k] for k in columns if k in row})
+            else:
+                results.append({k: v for k, v in row.items() if k != '_id'})
         return results
     
     def update(self, values: Dict[str, Any], where: callable) -> int:
         count = 0
-        for row in self.rows:
-            if where(row):
-                for col_name, value in values.items():
-                    if col_name in self.columns:
-                        old_val = row[col_name]
-                        new_val = self.columns[col_name].validate(value)
-                        
-                        if col_name in self.indexes:
-                            if old_val is not None:
-                                self.indexes[col_name].delete(old_val, row['_id'])
-                            if new_val is not None:
-                                if self.indexes[col_name].search(new_val):
-                                    raise ValueError(f"Duplicate value for {col_name}")
-                                self.indexes[col_name].insert(new_val, row['_id'])
-                        
-                        row[col_name] = new_val
-                count += 1
+        for row in self._scan(where):
+            changes = {}
+            for col_name, value in values.items():
+                if col_name in self.columns:
+                    col = self.columns[col_name]
+                    old_val = row[col_name]
+                    new_val = col.validate(value)
+                    if new_val == old_val:
+                        continue
+                    
+                    if (col.primary_key or col.unique) and new_val is not None and self._is_duplicate(col_name, new_val):
+                        raise ValueError(f"Duplicate value for {col_name}")
+                    self._check_parent(col_name, new_val)
+                    for child, child_col, parent_col, _ in self.referenced_by:
+                        if parent_col == col_name and old_val is not None and child.lookup(child_col, old_val):
+                            raise ValueError(f"Cannot update {self.name}.{col_name}: value is referenced by {child.name}.{child_col}")
+                    changes[col_name] = new_val
+            
+            if changes:
+                old_row = dict(row)
+                self._apply_changes(row, changes)
+                self.version += 1
+                self._notify(old_row, row)
+            count += 1
         return count
     
     def delete(self, where: callable) -> int:
-        to_delete = [row for row in self.rows if where(row)]
-        for row in to_delete:
-            for col_name in self.indexes:
-                if row[col_name] is not None:
-                    self.indexes[col_name].delete(row[col_name], row['_id'])
-            self.rows.remove(row)
+        to_delete = self._scan(where)
+        self._check_delete(to_delete)
+        self._delete_rows(to_delete)
         return len(to_delete)
 
+_scan_pool = None
+
+def _get_scan_pool() -> ThreadPoolExecutor:
+    global _scan_pool
+    if _scan_pool is None:
+        _scan_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    return _scan_pool
+
+def _stable_hash(value) -> int:
+    # hash() of a str changes between processes, which would move rows to other partitions after a reload
+    if isinstance(value, int):
+        return value
+    return zlib.crc32(repr(value).encode())
+
+class SegmentFile:
+    # An open database or partition file. Loaders read through the open handle, so a save by another
+    # process that replaces the path doesn't change the bytes a lazy table gets
+    def __init__(self, path: str, use_mmap: bool = False):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if use_mmap else None
+        self.users = 0
+        self.lock = threading.Lock()
+    
+    def size(self) -> int:
+        return os.fstat(self.file.fileno()).st_size
+    
+    def read(self, offset: int, length: int = None) -> bytes:
+        end = None if length is None else offset + length
+        if self.map is not None:
+            return self.map[offset:end]
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read() if length is None else self.file.read(length)
+    
+    def acquire(self):
+        with self.lock:
+            self.users += 1
+    
+    def release(self):
+        # Closed once no loader needs it any more
+        with self.lock:
+            self.users -= 1
+            if self.users == 0:
+                if self.map is not None:
+                    self.map.close()
+                self.file.close()
+
+class TableLoader:
+    # Reads a table's rows and indexes from its segment of a database file on first access
+    def __init__(self, source: SegmentFile, offset: int = 0, length: int = None, stats: Dict = None):
+        self.source = source
+        self.offset = offset
+        self.length = length
+        self.stats = stats
+        source.acquire()
+    
+    def read_blob(self) -> bytes:
+        return self.source.read(self.offset, self.length)
+    
+    def move_to(self, source: SegmentFile, offset: int, length: int):
+        source.acquire()
+        self.source.release()
+        self.source, self.offset, self.length = source, offset, length
+    
+    def load(self, table: Table):
+        start = time.perf_counter()
+        table.rows, table.indexes = pickle.loads(self.read_blob())
+        self.source.release()
+        if self.stats is not None:
+            self.stats['tables'][table.name] = time.perf_counter() - start
+
+class PartitionLinker:
+    def load(self, table: 'PartitionedTable'):
+        table._link_rows()
+
+class PartitionedTable(Table):
+    def __init__(self, name: str, columns: List[Column], method: str, partition_col: str, spec):
+        super().__init__(name, columns)
+        if partition_col not in self.columns:
+            raise ValueError(f"Partition column {partition_col} does not exist in {name}")
+        self.method = method.upper()
+        self.partition_col = partition_col
+        if self.method == 'HASH':
+            count = int(spec)
+            if count < 1:
+                raise ValueError("HASH partitioning needs at least 1 partition")
+        elif self.method == 'RANGE':
+            col = self.columns[partition_col]
+            self.bounds = [col.validate(bound) for bound in spec]
+            if any(a >= b for a, b in zip(self.bounds, self.bounds[1:])):
+                raise ValueError("RANGE bounds must be strictly increasing")
+            count = len(self.bounds) + 1
+        else:
+            raise ValueError(f"Unsupported partitioning method {method}")
+        
+        self.partitions = [Table(f"{name}_p{i}", columns) for i in range(count)]
+        self.indexes = {col_name: None for col_name in self.partitions[0].indexes}
+        self.dirty = set(range(count))
+        self.saved_path = None
+        self._link_rows()
+    
+    def _link_rows(self):
+        self.rows = ChainMap(*[partition.rows for partition in self.partitions])
+    
+    def _partition_index(self, value) -> int:
+        if value is None:
+            return 0
+        if self.method == 'HASH':
+            return _stable_hash(value) % len(self.partitions)
+        return bisect_right(self.bounds, value)
+    
+    def _prune(self, where: callable) -> List[int]:
+        everything = list(range(len(self.partitions)))
+        if not isinstance(where, Condition) or where.col != self.partition_col:
+            return everything
+        try:
+            key = self.columns[self.partition_col].validate(where.val)
+        except (ValueError, TypeError):
+            return everything
+        if key is None:
+            return everything
+        
+        if where.op == '=':
+            return [self._partition_index(key)]
+        if self.method == 'RANGE':
+            if where.op == '<':
+                return everything[:bisect_left(self.bounds, key) + 1]
+            if where.op == '<=':
+                return everything[:bisect_right(self.bounds, key) + 1]
+            if where.op in ('>', '>='):
+                return everything[bisect_right(self.bounds, key):]
+        return everything
+    
+    def create_index(self, col_name: str):
+        if col_name not in self.columns:
+            raise ValueError(f"Column {col_name} does not exist in {self.name}")
+        for i, partition in enumerate(self.partitions):
+            if col_name not in partition.indexes:
+                partition.create_index(col_name)
+                self.dirty.add(i)
+        self.indexes[col_name] = None
+    
+    def lookup(self, col_name: str, value) -> List[Dict]:
+        partitions = self.partitions
+        if col_name == self.partition_col:
+            partitions = [self.partitions[self._partition_index(value)]]
+        return [row for partition in partitions for row in partition.lookup(col_name, value)]
+    
+    def _scan(self, where: callable = None) -> List[Dict]:
+        partitions = [self.partitions[i] for i in self._prune(where)]
+        if len(partitions) == 1:
+            return partitions[0]._scan(where)
+        return [row for rows in _get_scan_pool().map(lambda p: p._scan(where), partitions) for row in rows]
+    
+    def _store_row(self, row: Dict):
+        i = self._partition_index(row[self.partition_col])
+        self.partitions[i]._store_row(row)
+        self.dirty.add(i)
+    
+    def _unstore_row(self, row: Dict):
+        i = self._partition_index(row[self.partition_col])
+        self.partitions[i]._unstore_row(row)
+        self.dirty.add(i)
+    
+    def _apply_changes(self, row: Dict, changes: Dict[str, Any]):
+        i = self._partition_index(row[self.partition_col])
+        if self.partition_col in changes and self._partition_index(changes[self.partition_col]) != i:
+            self._unstore_row(row)
+            row.update(changes)
+            self._store_row(row)
+        else:
+            self.partitions[i]._apply_changes(row, changes)
+            self.dirty.add(i)
+    
+    def _is_duplicate(self, col_name: str, value) -> bool:
+        partitions = self.partitions
+        if col_name == self.partition_col:
+            partitions = [self.partitions[self._partition_index(value)]]
+        return any(partition._is_duplicate(col_name, value) for partition in partitions)
+    
+    def _partition_file(self, filepath: str, i: int) -> str:
+        return f"{filepath}.{self.name}.p{i}"
+    
+    def save_partitions(self, filepath: str):
+        # Only partitions that changed since the last save to this file are rewritten
+        for i, partition in enumerate(self.partitions):
+            part_file = self._partition_file(filepath, i)
+            if i in self.dirty or filepath != self.saved_path or not os.path.exists(part_file):
+                with open(part_file + '.tmp', 'wb') as f:
+                    pickle.dump((partition.rows, partition.indexes), f)
+                os.replace(part_file + '.tmp', part_file)
+        self.dirty = set()
+        self.saved_path = filepath
+    
+    def load_partitions(self, filepath: str, use_mmap: bool = False, stats: Dict = None):
+        # Each partition is read from its own file the first time it is touched
+        # Each file is opened now so a later save by another process doesn't swap it under us
+        for i, partition in enumerate(self.partitions):
+            source = SegmentFile(self._partition_file(filepath, i), use_mmap)
+            partition.defer(TableLoader(source, stats=stats))
+        self.defer(PartitionLinker())
+        self.dirty = set()
+        self.saved_path = filepath
+    
+    def defer(self, loader):
+        self.__dict__.pop('rows', None)
+        self._loader = loader
+    
+    def detach_data(self):
+        parts = [partition.detach_data() for partition in self.partitions]
+        loader = self.__dict__.pop('_loader', None)
+        self._link_rows()
+        return loader, parts
+    
+    def attach_data(self, data):
+        loader, parts = data
+        for partition, part in zip(self.partitions, parts):
+            partition.attach_data(part)
+        if loader is not None:
+            self.defer(loader)
+        else:
+            self._link_rows()
+
+class MaterializedView:
+    AGGREGATES = ('COUNT', 'SUM', 'AVG')
+    
+    def __init__(self, name: str, tables: List[Table], columns: List[Tuple[str, int, str]],
+                 where: callable = None, join_on: Tuple[str, str] = None,
+                 group_by: List[str] = None, aggregates: List[Tuple[str, str, Optional[str]]] = None):
+        self.name = name
+        self.tables = tables
+        self.columns = columns          # (view column, base table position, base column)
+        self.where = where
+        self.join_on = join_on          # (left column, right column)
+        self.group_by = group_by or []
+        self.aggregates = aggregates or []  # (view column, function, base column or None)
+        self.keys = {}                  # view key -> _id of the row in self.table
+        self.sources = defaultdict(set) # (base table position, base _id) -> view keys
+        self.groups = {}
+        
+        if self.join_on:
+            for pos, table in enumerate(self.tables):
+                table.create_index(self.join_on[pos])
+        
+        self.table = Table(name, self._build_columns())
+        for view_col, _, _ in self.columns:
+            self.table.create_index(view_col)
+    
+    def _build_columns(self) -> List[Column]:
+        columns = []
+        for view_col, pos, base_col in self.columns:
+            columns.append(Column(view_col, self.tables[pos].columns[base_col].dtype))
+        for view_col, func, base_col in self.aggregates:
+            if func == 'COUNT':
+                dtype = 'INT'
+            elif func == 'SUM' and self.tables[0].columns[base_col].dtype == 'INT':
+                dtype = 'INT'
+            else:
+                dtype = 'FLOAT'
+            columns.append(Column(view_col, dtype))
+        return columns
+    
+    def populate(self):
+        if self.aggregates and not self.group_by:
+            self.groups[()] = self._new_group()
+            self._refresh_group(())
+        for row in list(self.tables[0].rows.values()):
+            self._add(0, row)
+    
+    def on_change(self, table: Table, old_row: Optional[Dict], new_row: Optional[Dict]):
+        positions = [pos for pos, base in enumerate(self.tables) if base is table]
+        if old_row is not None:
+            for pos in positions:
+                self._remove(pos, old_row)
+        if new_row is not None:
+            for pos in positions:
+                self._add(pos, new_row)
+    
+    def _add(self, pos: int, row: Dict):
+        if self.aggregates or self.group_by:
+            self._apply_group(row, 1)
+        elif self.join_on:
+            value = row[self.join_on[pos]]
+            if value is None:
+                return
+            other = 1 - pos
+            for match in self.tables[other].lookup(self.join_on[other], value):
+                pair = (row, match) if pos == 0 else (match, row)
+                key = (pair[0]['_id'], pair[1]['_id'])
+                if key in self.keys:
+                    continue
+                values = {view_col: pair[p][base_col] for view_col, p, base_col in self.columns}
+                self.keys[key] = self.table.insert(values)
+                self.sources[(0, key[0])].add(key)
+                self.sources[(1, key[1])].add(key)
+        elif self.where is None or self.where(row):
+            key = (row['_id'],)
+            values = {view_col: row[base_col] for view_col, _, base_col in self.columns}
+            self.keys[key] = self.table.insert(values)
+            self.sources[(0, key[0])].add(key)
+    
+    def _remove(self, pos: int, row: Dict):
+        if self.aggregates or self.group_by:
+            self._apply_group(row, -1)
+            return
+        for key in self.sources.pop((pos, row['_id']), set()):
+            view_id = self.keys.pop(key, None)
+            if view_id is None:
+                continue
+            self.table._remove_row(self.table.rows[view_id])
+            for p, base_id in enumerate(key):
+                if (p, base_id) in self.sources:
+                    self.sources[(p, base_id)].discard(key)
+    
+    def _new_group(self) -> Dict:
+        return {'rows': 0, 'counts': defaultdict(int), 'sums': defaultdict(int)}
+    
+    def _apply_group(self, row: Dict, sign: int):
+        if self.where is not None and not self.where(row):
+            return
+        key = tuple(row[col] for col in self.group_by)
+        group = self.groups.setdefault(key, self._new_group())
+        group['rows'] += sign
+        for base_col in {base_col for _, _, base_col in self.aggregates if base_col}:
+            if row[base_col] is not None:
+                group['counts'][base_col] += sign
+                group['sums'][base_col] += sign * row[base_col]
+        self._refresh_group(key)
+    
+    def _refresh_group(self, key: Tuple):
+        view_id = self.keys.pop(key, None)
+        if view_id is not None:
+            self.table._remove_row(self.table.rows[view_id])
+        
+        group = self.groups[key]
+        if group['rows'] == 0 and self.group_by:
+            del self.groups[key]
+            return
+        
+        values = dict(zip(self.group_by, key))
+        for view_col, func, base_col in self.aggregates:
+            if base_col is None:
+                values[view_col] = group['rows']
+            elif func == 'COUNT':
+                values[view_col] = group['counts'][base_col]
+            elif not group['counts'][base_col]:
+                values[view_col] = None
+            elif func == 'SUM':
+                values[view_col] = group['sums'][base_col]
+            else:
+                values[view_col] = group['sums'][base_col] / group['counts'][base_col]
+        self.keys[key] = self.table.insert(values)
+
+class ChangeLog:
+    # Append-only file of write statements, one JSON record per line, that replicas tail
+    def __init__(self, path: str):
+        self.path = path
+    
+    def append(self, lsn: int, sql: str):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'lsn': lsn, 'ts': time.time(), 'sql': sql}) + '\n')
+    
+    def read_from(self, offset: int, inode: int = None) -> Tuple[List[Dict], int, int]:
+        # inode is the file the offset belongs to; if trim() has replaced it since, read the new file from the start
+        if not os.path.exists(self.path):
+            return [], offset, inode
+        with open(self.path, 'rb') as f:
+            current = os.fstat(f.fileno()).st_ino
+            if inode is not None and current != inode:
+                offset = 0
+            f.seek(offset)
+            data = f.read()
+        # A line without its newline is still being written; leave it for the next read
+        end = data.rfind(b'\n') + 1
+        records = [json.loads(line) for line in data[:end].splitlines() if line]
+        return records, offset + end, current
+    
+    def offset_after(self, lsn: int) -> Tuple[int, Optional[int]]:
+        # Records are in LSN order, so a binary search over byte offsets finds the first one past lsn
+        # without reading the records before it
+        if not os.path.exists(self.path):
+            return 0, None
+        with open(self.path, 'rb') as f:
+            def line_start(pos):
+                f.seek(max(pos - 1, 0))
+                if pos > 0:
+                    f.readline()
+                return f.tell()
+            
+            lo, hi = 0, os.fstat(f.fileno()).st_size
+            while lo < hi:
+                mid = (lo + hi) // 2
+                start = line_start(mid)
+                line = f.readline()
+                if line.endswith(b'\n') and json.loads(line)['lsn'] <= lsn:
+                    lo = start + len(line)
+                else:
+                    hi = mid
+            return line_start(lo), os.fstat(f.fileno()).st_ino
+    
+    def last_lsn(self) -> int:
+        # Reads back from the end of the file until it has the last complete record
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as f:
+            pos = f.seek(0, os.SEEK_END)
+            data = b''
+            while pos > 0:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+                end = data.rfind(b'\n')
+                if end < 0:
+                    continue
+                start = data.rfind(b'\n', 0, end)
+                if start >= 0 or pos == 0:
+                    return json.loads(data[start + 1:end])['lsn']
+        return 0
+    
+    def trim(self, upto_lsn: int) -> int:
+        # Rewrites the log without the records up to upto_lsn. The new file replaces the old one,
+        # which tells tailing replicas to start over on it
+        records, _, _ = self.read_from(0)
+        kept = [record for record in records if record['lsn'] > upto_lsn]
+        with open(self.path + '.tmp', 'w') as f:
+            for record in kept:
+                f.write(json.dumps(record) + '\n')
+        os.replace(self.path + '.tmp', self.path)
+        return len(records) - len(kept)
+
 class Database:
     def __init__(self, name: str = "mydb"):
         self.name = name
         self.tables = {}
+        self.views = {}
+        self.load_stats = {}
+        self.lsn = 0
+        self.saved_lsn = 0
+        self.change_log = None
+        self.write_lock = threading.RLock()
+    
+    def __getstate__(self):
+        # The log belongs to the running primary, not to snapshots of it
+        state = dict(self.__dict__)
+        state['change_log'] = None
+        del state['write_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('views', {})
+        self.__dict__.setdefault('load_stats', {})
+        self.__dict__.setdefault('lsn', 0)
+        self.__dict__.setdefault('saved_lsn', self.lsn)
+        self.__dict__.setdefault('change_log', None)
+        self.write_lock = threading.RLock()
     
-    def create_table(self, table_name: str, columns: List[Column]):
-        if table_name in self.tables:
+    def enable_replication(self, log_path: str):
+        self.change_log = ChangeLog(log_path)
+        self.lsn = max(self.lsn, self.change_log.last_lsn())
+    
+    def log_change(self, sql: str):
+        if self.change_log is not None:
+            self.lsn += 1
+            self.change_log.append(self.lsn, sql)
+    
+    def trim_log(self) -> int:
+        # Drops the log records that the last save already holds. A replica that hadn't applied them yet
+        # reloads the snapshot instead
+        if self.change_log is None:
+            raise ValueError("Replication is not enabled")
+        with self.write_lock:
+            return self.change_log.trim(self.saved_lsn)
+    
+    def create_table(self, table_name: str, columns: List[Column], partition_by: Tuple = None):
+        if table_name in self.tables or table_name in self.views:
             raise ValueError(f"Table {table_name} already exists")
-        self.tables[table_name] = Table(table_name, columns)
+        if partition_by:
+            self.tables[table_name] = PartitionedTable(table_name, columns, *partition_by)
+        else:
+            self.tables[table_name] = Table(table_name, columns)
+        try:
+            for col in columns:
+                if col.references:
+                    self.add_foreign_key(table_name, col.name, *col.references, on_delete=col.on_delete)
+        except ValueError:
+            # Undo the references registered before the one that failed
+            table = self.tables.pop(table_name)
+            for _, parent, _ in table.foreign_keys:
+                parent.referenced_by = [ref for ref in parent.referenced_by if ref[0] is not table]
+            raise
+    
+    def add_foreign_key(self, table_name: str, col_name: str, ref_table: str, ref_col: str, on_delete: str = 'RESTRICT'):
+        if table_name not in self.tables or ref_table not in self.tables:
+            raise ValueError(f"Table {table_name if table_name not in self.tables else ref_table} does not exist")
+        table = self.tables[table_name]
+        parent = self.tables[ref_table]
+        if col_name not in table.columns:
+            raise ValueError(f"Column {col_name} does not exist in {table_name}")
+        parent_col = parent.columns.get(ref_col)
+        if parent_col is None or not (parent_col.primary_key or parent_col.unique):
+            raise ValueError(f"{ref_table}.{ref_col} must be a PRIMARY KEY or UNIQUE column")
+        on_delete = on_delete.upper()
+        if on_delete not in ('CASCADE', 'RESTRICT'):
+            raise ValueError(f"Unsupported ON DELETE action {on_delete}")
+        
+        for row in table.rows.values():
+            if row[col_name] is not None and not parent.lookup(ref_col, row[col_name]):
+                raise ValueError(f"Foreign key violation: {col_name}={row[col_name]} not found in {ref_table}.{ref_col}")
+        
+        table.create_index(col_name)
+        table.foreign_keys.append((col_name, parent, ref_col))
+        parent.referenced_by.append((table, col_name, ref_col, on_delete))
     
     def drop_table(self, table_name: str):
         if table_name not in self.tables:
             raise ValueError(f"Table {table_name} does not exist")
+        table = self.tables[table_name]
+        for view in self.views.values():
+            if table in view.tables:
+                raise ValueError(f"Table {table_name} is used by materialized view {view.name}")
+        for child, child_col, _, _ in table.referenced_by:
+            if child is not table:
+                raise ValueError(f"Table {table_name} is referenced by {child.name}.{child_col}")
+        for _, parent, _ in table.foreign_keys:
+            parent.referenced_by = [ref for ref in parent.referenced_by if ref[0] is not table]
+        table.version += 1
         del self.tables[table_name]
     
     def get_table(self, table_name: str) -> Table:
+        if table_name in self.views:
+            return self.views[table_name].table
         if table_name not in self.tables:
             raise ValueError(f"Table {table_name} does not exist")
         return self.tables[table_name]
     
+    def create_view(self, view: MaterializedView):
+        if view.name in self.tables or view.name in self.views:
+            raise ValueError(f"Table {view.name} already exists")
+        view.populate()
+        for table in view.tables:
+            if view not in table.listeners:
+                table.listeners.append(view)
+        self.views[view.name] = view
+    
+    def drop_view(self, view_name: str):
+        if view_name not in self.views:
+            raise ValueError(f"Materialized view {view_name} does not exist")
+        view = self.views.pop(view_name)
+        view.table.version += 1
+        for table in view.tables:
+            if view in table.listeners:
+                table.listeners.remove(view)
+    
     def save(self, filepath: str):
-        with open(filepath, 'wb') as f:
-            pickle.dump(self, f)
+        # Layout: magic, one pickled (rows, indexes) segment per table, the catalog, then the catalog's offset.
+        # Tables that were never read since a lazy load are copied over as raw bytes.
+        with self.write_lock:
+            self.saved_lsn = self.lsn
+            segments = {}
+            detached = {}
+            tmp_path = filepath + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(FILE_MAGIC)
+                for name, table in self.tables.items():
+                    if isinstance(table, PartitionedTable):
+                        table.save_partitions(filepath)
+                        continue
+                    loader = table.__dict__.get('_loader')
+                    blob = loader.read_blob() if loader else pickle.dumps((table.rows, table.indexes))
+                    segments[name] = (f.tell(), len(blob))
+                    f.write(blob)
+                
+                for name, table in self.tables.items():
+                    detached[name] = table.detach_data()
+                try:
+                    catalog_offset = f.tell()
+                    pickle.dump((self, segments), f)
+                    f.write(catalog_offset.to_bytes(8, 'big'))
+                finally:
+                    for name, data in detached.items():
+                        self.tables[name].attach_data(data)
+            
+            # Tables still unread move to the new file, opened before it takes the path
+            loaders = {name: self.tables[name].__dict__.get('_loader') for name in segments}
+            loaders = {name: loader for name, loader in loaders.items() if loader is not None}
+            if loaders:
+                use_mmap = any(loader.source.map is not None for loader in loaders.values())
+                source = SegmentFile(tmp_path, use_mmap)
+                source.acquire()
+                for name, loader in loaders.items():
+                    loader.move_to(source, *segments[name])
+                source.release()
+            os.replace(tmp_path, filepath)
+            self._remove_stale_partitions(filepath)
+    
+    def _remove_stale_partitions(self, filepath: str):
+        # Partition files of dropped tables, or beyond the partition count of a recreated one
+        directory = os.path.dirname(filepath) or '.'
+        expected = {os.path.basename(table._partition_file(filepath, i))
+                    for table in self.tables.values() if isinstance(table, PartitionedTable)
+                    for i in range(len(table.partitions))}
+        pattern = re.escape(os.path.basename(filepath)) + r'\.\w+\.p\d+'
+        for entry in os.listdir(directory):
+            if re.fullmatch(pattern, entry) and entry not in expected:
+                os.remove(os.path.join(directory, entry))
+    
+    @staticmethod
+    def load(filepath: str, lazy: bool = False, use_mmap: bool = False):
+        # Segments are read through the handle the catalog came from, never by reopening the path
+        start = time.perf_counter()
+        source = SegmentFile(filepath, use_mmap)
+        source.acquire()
+        try:
+            if source.read(0, len(FILE_MAGIC)) == FILE_MAGIC:
+                end = source.size() - 8
+                catalog_offset = int.from_bytes(source.read(end, 8), 'big')
+                db, segments = pickle.loads(source.read(catalog_offset, end - catalog_offset))
+            else:
+                db, segments = pickle.loads(source.read(0)), {}
+            
+            db.load_stats = {'lazy': lazy, 'mmap': use_mmap, 'tables': {}}
+            for name, table in db.tables.items():
+                if isinstance(table, PartitionedTable):
+                    table.load_partitions(filepath, use_mmap, db.load_stats)
+                elif name in segments:
+                    table.defer(TableLoader(source, *segments[name], stats=db.load_stats))
+            db.load_stats['catalog_seconds'] = time.perf_counter() - start
+            
+            if not lazy:
+                for table in db.tables.values():
+                    table.materialize()
+        finally:
+            source.release()
+        db.load_stats['open_seconds'] = time.perf_counter() - start
+        return db
+
+class QueryCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()    # key -> (result, [(table, version)], size)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key, db: Database):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if all(self._current(db, table, version) for table, version in entry[1]):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._discard(key)
+            self.misses += 1
+            return None
+    
+    def put(self, key, result: List[Dict], versions: List[Tuple[Table, int]]):
+        size = self._result_size(result)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._discard(key)
+            self.entries[key] = (result, versions, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._discard(next(iter(self.entries)))
+                self.evictions += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+            }
+    
+    def _current(self, db: Database, table: Table, version: int) -> bool:
+        try:
+            return db.get_table(table.name) is table and table.version == version
+        except ValueError:
+            return False
+    
+    def _discard(self, key):
+        self.size -= self.entries.pop(key)[2]
     
     @staticmethod
-    def load(filepath: str):
-        with open(filepath, 'rb') as f:
-            return pickle.load(f)
+    def _result_size(result: List[Dict]) -> int:
+        size = sys.getsizeof(result)
+        for row in result:
+            size += sys.getsizeof(row)
+            for k, v in row.items():
+                size += sys.getsizeof(k) + sys.getsizeof(v)
+        return size
 
 class SQLParser:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, cache_bytes: int = 0, read_only: bool = False):
         self.db = db
+        self.cache = QueryCache(cache_bytes) if cache_bytes else None
+        self.read_only = read_only
     
-    def parse_and_execute(self, sql: str):
+    def parse_and_execute(self, sql: str, params: Tuple = ()):
         sql = sql.strip().rstrip(';')
+        is_select = sql.upper().startswith('SELECT')
         
+        if self.cache is not None and is_select:
+            return self._cached_select(sql, tuple(params))
+        if params:
+            sql = self._bind(sql, params)
+        if self.read_only and not is_select:
+            raise ValueError("Database is read-only, only SELECT is allowed")
+        if is_select:
+            return self._execute(sql)
+        
+        # Writes run one at a time so the log order matches execution order and a save
+        # never lands between a change and its log record
+        with self.db.write_lock:
+            if self.db.change_log is None:
+                return self._execute(sql)
+            
+            # Statements are shipped to replicas as written. One that failed halfway is shipped too,
+            # since replaying it fails at the same row
+            versions = sum(table.version for table in self.db.tables.values())
+            try:
+                result = self._execute(sql)
+            except Exception:
+                if sum(table.version for table in self.db.tables.values()) != versions:
+                    self.db.log_change(sql)
+                raise
+            self.db.log_change(sql)
+            return result
+    
+    def _execute(self, sql: str):
         if sql.upper().startswith('CREATE TABLE'):
             return self._create_table(sql)
+        elif sql.upper().startswith('CREATE MATERIALIZED VIEW'):
+            return self._create_materialized_view(sql)
+        elif sql.upper().startswith('DROP MATERIALIZED VIEW'):
+            return self._drop_materialized_view(sql)
         elif sql.upper().startswith('INSERT INTO'):
             return self._insert(sql)
         elif sql.upper().startswith('SELECT'):
@@ -180,10 +1088,63 @@ class SQLParser:
             return self._delete(sql)
         elif sql.upper().startswith('DROP TABLE'):
             return self._drop_table(sql)
+        elif sql.upper().startswith('ALTER TABLE'):
+            return self._alter_table(sql)
         else:
             raise ValueError("Unsupported SQL statement")
     
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.cache.stats() if self.cache is not None else {}
+    
+    def _bind(self, sql: str, params: Tuple) -> str:
+        parts = sql.split('?')
+        if len(parts) != len(params) + 1:
+            raise ValueError(f"Expected {len(parts) - 1} parameters, got {len(params)}")
+        bound = parts[0]
+        for value, part in zip(params, parts[1:]):
+            if isinstance(value, bool):
+                literal = 'true' if value else 'false'
+            elif isinstance(value, (int, float)):
+                literal = str(value)
+            else:
+                literal = f"'{value}'"
+            bound += literal + part
+        return bound
+    
+    def _cached_select(self, sql: str, params: Tuple):
+        # Keyed on the bound statement: 1, 1.0 and True are equal as parameters but bind to different SQL.
+        # Whitespace outside quoted literals doesn't change the query, so it doesn't split the cache
+        if params:
+            sql = self._bind(sql, params)
+        key = re.sub(r"('[^']*'|\"[^\"]*\")|\s+", lambda m: m.group(1) or ' ', sql)
+        result = self.cache.get(key, self.db)
+        if result is None:
+            from_clause = re.split(r'\s+WHERE\s+', sql, 1, re.IGNORECASE)[0]
+            names = re.findall(r'(?:FROM|JOIN)\s+(\w+)', from_clause, re.IGNORECASE)
+            versions = [(table, table.version) for table in map(self.db.get_table, names)]
+            result = self._select(sql)
+            self.cache.put(key, result, versions)
+        return [dict(row) for row in result]
+    
     def _create_table(self, sql: str):
+        partition_by = None
+        partition_match = re.match(r'(.*?)\s+PARTITION BY\s+(RANGE|HASH)\s*\(\s*(\w+)\s*\)\s*(.*)$',
+                                   sql, re.IGNORECASE | re.DOTALL)
+        if partition_match:
+            sql, method, partition_col, spec = partition_match.groups()
+            method = method.upper()
+            if method == 'HASH':
+                spec_match = re.match(r'PARTITIONS\s+(\d+)$', spec, re.IGNORECASE)
+                if not spec_match:
+                    raise ValueError("Invalid PARTITION BY HASH syntax, expected PARTITIONS <n>")
+                partition_by = (method, partition_col, int(spec_match.group(1)))
+            else:
+                spec_match = re.match(r'BOUNDS\s*\((.*)\)$', spec, re.IGNORECASE | re.DOTALL)
+                if not spec_match:
+                    raise ValueError("Invalid PARTITION BY RANGE syntax, expected BOUNDS (v1, v2, ...)")
+                bounds = [b.strip().strip("'\"") for b in spec_match.group(1).split(',')]
+                partition_by = (method, partition_col, bounds)
+        
         match = re.match(r'CREATE TABLE (\w+)\s*\((.*)\)', sql, re.IGNORECASE | re.DOTALL)
         if not match:
             raise ValueError("Invalid CREATE TABLE syntax")
@@ -202,11 +1163,112 @@ class SQLParser:
             unique = 'UNIQUE' in col_def.upper()
             nullable = 'NOT NULL' not in col_def.upper()
             
-            columns.append(Column(col_name, col_type, primary_key, unique, nullable))
+            ref_match = re.search(r'REFERENCES\s+(\w+)\s*\(\s*(\w+)\s*\)(?:\s+ON\s+DELETE\s+(CASCADE|RESTRICT))?',
+                                  col_def, re.IGNORECASE)
+            references = (ref_match.group(1), ref_match.group(2)) if ref_match else None
+            on_delete = ref_match.group(3) if ref_match and ref_match.group(3) else 'RESTRICT'
+            
+            columns.append(Column(col_name, col_type, primary_key, unique, nullable, references, on_delete))
         
-        self.db.create_table(table_name, columns)
+        self.db.create_table(table_name, columns, partition_by)
         return f"Table {table_name} created"
     
+    def _alter_table(self, sql: str):
+        match = re.match(r'ALTER TABLE (\w+)\s+ADD FOREIGN KEY\s*\(\s*(\w+)\s*\)\s*REFERENCES\s+(\w+)\s*\(\s*(\w+)\s*\)'
+                         r'(?:\s+ON\s+DELETE\s+(CASCADE|RESTRICT))?$', sql, re.IGNORECASE)
+        if not match:
+            raise ValueError("Invalid ALTER TABLE syntax, expected ADD FOREIGN KEY (col) REFERENCES table(col)")
+        
+        table_name, col_name, ref_table, ref_col, on_delete = match.groups()
+        self._get_writable_table(table_name)
+        self.db.add_foreign_key(table_name, col_name, ref_table, ref_col, on_delete or 'RESTRICT')
+        return f"Foreign key added to {table_name}"
+    
+    def _create_materialized_view(self, sql: str):
+        match = re.match(r'CREATE MATERIALIZED VIEW (\w+)\s+AS\s+(SELECT .*)', sql, re.IGNORECASE | re.DOTALL)
+        if not match:
+            raise ValueError("Invalid CREATE MATERIALIZED VIEW syntax")
+        
+        view_name = match.group(1)
+        query = match.group(2).strip()
+        join_match = re.search(r'JOIN\s+(\w+)\s+ON\s+([\w.]+)\s*=\s*([\w.]+)', query, re.IGNORECASE)
+        
+        if join_match:
+            main_match = re.match(r'SELECT (.*?) FROM (\w+)\s+JOIN', query, re.IGNORECASE | re.DOTALL)
+            tables = [self.db.get_table(main_match.group(2)), self.db.get_table(join_match.group(1))]
+            join_on = tuple(c.split('.')[1] if '.' in c else c for c in join_match.groups()[1:])
+            
+            if query[join_match.end():].strip():
+                raise ValueError("Materialized views over a JOIN don't support WHERE or GROUP BY")
+            
+            columns = []
+            for item in main_match.group(1).split(','):
+                item = item.strip()
+                matched = [(f"{table.name}.{col_name}", pos, col_name)
+                           for pos, table in enumerate(tables) for col_name in table.columns
+                           if item == '*' or item == f"{table.name}.{col_name}"]
+                if not matched:
+                    raise ValueError(f"Column {item} does not resolve to table.column in the joined tables")
+                columns.extend(matched)
+            view = MaterializedView(view_name, tables, columns, join_on=join_on)
+        else:
+            match = re.match(r'SELECT (.*?) FROM (\w+)(?:\s+WHERE\s+(.*?))?(?:\s+GROUP BY\s+(.*))?$',
+                             query, re.IGNORECASE | re.DOTALL)
+            if not match:
+                raise ValueError("Invalid SELECT syntax")
+            
+            table = self.db.get_table(match.group(2))
+            where_func = self._parse_where(match.group(3)) if match.group(3) else None
+            if where_func is not None and not isinstance(where_func, Condition):
+                raise ValueError(f"Unsupported WHERE clause in materialized view: {match.group(3)}")
+            group_by = [c.strip() for c in match.group(4).split(',')] if match.group(4) else []
+            
+            columns = []
+            aggregates = []
+            for item in match.group(1).split(','):
+                item = item.strip()
+                agg_match = re.match(r'(\w+)\(\s*(\*|\w+)\s*\)$', item)
+                if agg_match:
+                    func = agg_match.group(1).upper()
+                    base_col = None if agg_match.group(2) == '*' else agg_match.group(2)
+                    if func not in MaterializedView.AGGREGATES or (base_col is None and func != 'COUNT'):
+                        raise ValueError(f"Unsupported aggregate {item}")
+                    aggregates.append((f"{func}({agg_match.group(2)})", func, base_col))
+                elif item == '*':
+                    columns.extend((col_name, 0, col_name) for col_name in table.columns)
+                else:
+                    columns.append((item, 0, item))
+            
+            if aggregates or group_by:
+                if any(view_col not in group_by for view_col, _, _ in columns):
+                    raise ValueError("Non-aggregated columns must appear in GROUP BY")
+                columns = [(col_name, 0, col_name) for col_name in group_by]
+            for view_col, _, base_col in columns + aggregates:
+                if base_col is not None and base_col not in table.columns:
+                    raise ValueError(f"Column {base_col} does not exist in {table.name}")
+            for view_col, func, base_col in aggregates:
+                if func in ('SUM', 'AVG') and table.columns[base_col].dtype not in ('INT', 'FLOAT'):
+                    raise ValueError(f"{view_col} needs an INT or FLOAT column")
+            view = MaterializedView(view_name, [table], columns, where=where_func,
+                                    group_by=group_by, aggregates=aggregates)
+        
+        self.db.create_view(view)
+        return f"Materialized view {view_name} created"
+    
+    def _drop_materialized_view(self, sql: str):
+        match = re.match(r'DROP MATERIALIZED VIEW (\w+)', sql, re.IGNORECASE)
+        if not match:
+            raise ValueError("Invalid DROP MATERIALIZED VIEW syntax")
+        
+        view_name = match.group(1)
+        self.db.drop_view(view_name)
+        return f"Materialized view {view_name} dropped"
+    
+    def _get_writable_table(self, table_name: str) -> Table:
+        if table_name in self.db.views:
+            raise ValueError(f"Materialized view {table_name} is read-only")
+        return self.db.get_table(table_name)
+    
     def _insert(self, sql: str):
         match = re.match(r'INSERT INTO (\w+)\s*\((.*?)\)\s*VALUES\s*\((.*?)\)', sql, re.IGNORECASE)
         if not match:
@@ -216,7 +1278,7 @@ class SQLParser:
         columns = [c.strip() for c in match.group(2).split(',')]
         values = [v.strip().strip("'\"") for v in match.group(3).split(',')]
         
-        table = self.db.get_table(table_name)
+        table = self._get_writable_table(table_name)
         row_data = dict(zip(columns, values))
         table.insert(row_data)
         return "1 row inserted"
@@ -256,8 +1318,8 @@ class SQLParser:
         table2 = self.db.get_table(table2_name)
         
         results = []
-        for row1 in table1.rows:
-            for row2 in table2.rows:
+        for row1 in table1.rows.values():
+            for row2 in table2.rows.values():
                 if row1.get(t1_col) == row2.get(t2_col):
                     joined = {}
                     for k, v in row1.items():
@@ -283,7 +1345,7 @@ class SQLParser:
         set_clause = match.group(2)
         where_clause = match.group(3)
         
-        table = self.db.get_table(table_name)
+        table = self._get_writable_table(table_name)
         
         updates = {}
         for assignment in set_clause.split(','):
@@ -305,7 +1367,7 @@ class SQLParser:
         table_name = match.group(1)
         where_clause = match.group(2)
         
-        table = self.db.get_table(table_name)
+        table = self._get_writable_table(table_name)
         where_func = self._parse_where(where_clause) if where_clause else lambda x: True
         count = table.delete(where_func)
         return f"{count} row(s) deleted"
@@ -322,38 +1384,96 @@ class SQLParser:
     def _parse_where(self, where_clause: str):
         where_clause = where_clause.strip()
         
-        match = re.match(r"(\w+)\s*(=|!=|>|<|>=|<=)\s*(.+)", where_clause)
+        match = re.match(r"([\w.]+)\s*(!=|>=|<=|=|>|<)\s*(.+)", where_clause)
         if match:
             col = match.group(1)
             op = match.group(2)
             val = match.group(3).strip().strip("'\"")
             
-            def where_func(row):
-                row_val = row.get(col)
-                if row_val is None:
-                    return False
-                try:
-                    if isinstance(row_val, (int, float)):
-                        try:
-                            val_typed = type(row_val)(val)
-                        except:
-                            val_typed = val
-                    else:
-                        val_typed = val
-                    
-                    if op == '=': return row_val == val_typed
-                    elif op == '!=': return row_val != val_typed
-                    elif op == '>': return row_val > val_typed
-                    elif op == '<': return row_val < val_typed
-                    elif op == '>=': return row_val >= val_typed
-                    elif op == '<=': return row_val <= val_typed
-                except:
-                    return False
-            
-            return where_func
+            return Condition(col, op, val)
         
         return lambda x: True
 
+class Replica:
+    # Follows a primary by replaying its change log on top of a snapshot, and serves SELECTs only
+    def __init__(self, snapshot_path: str, log_path: str, poll_interval: float = 0.1, cache_bytes: int = 0):
+        self.snapshot_path = snapshot_path
+        self.log = ChangeLog(log_path)
+        self.poll_interval = poll_interval
+        self.cache_bytes = cache_bytes
+        self.errors = 0
+        self.last_applied_ts = None
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._load_snapshot()
+    
+    def _load_snapshot(self):
+        # Starts reading the log at the first record the snapshot doesn't have
+        self.db = Database.load(self.snapshot_path)
+        self.parser = SQLParser(self.db, cache_bytes=self.cache_bytes, read_only=True)
+        self._applier = SQLParser(self.db)
+        self.offset, self.log_inode = self.log.offset_after(self.db.lsn)
+        self.pending = []
+    
+    def _fetch(self):
+        records, self.offset, self.log_inode = self.log.read_from(self.offset, self.log_inode)
+        last = self.pending[-1]['lsn'] if self.pending else self.db.lsn
+        records = [record for record in records if record['lsn'] > last]
+        if records and records[0]['lsn'] > last + 1:
+            # The primary trimmed records this replica hadn't applied, so start again from its latest save
+            self._load_snapshot()
+            records = [record for record in records if record['lsn'] > self.db.lsn]
+        self.pending.extend(records)
+    
+    def poll(self) -> int:
+        with self.lock:
+            self._fetch()
+            applied = len(self.pending)
+            for record in self.pending:
+                try:
+                    self._applier.parse_and_execute(record['sql'])
+                except Exception:
+                    self.errors += 1
+                self.db.lsn = record['lsn']
+                self.last_applied_ts = record['ts']
+            self.pending = []
+            return applied
+    
+    def parse_and_execute(self, sql: str, params: Tuple = ()):
+        with self.lock:
+            return self.parser.parse_and_execute(sql, params)
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.parser.cache_stats()
+    
+    def lag(self) -> Dict[str, Any]:
+        with self.lock:
+            self._fetch()
+            return {
+                'applied_lsn': self.db.lsn,
+                'primary_lsn': self.pending[-1]['lsn'] if self.pending else self.db.lsn,
+                'records_behind': len(self.pending),
+                'seconds_behind': time.time() - self.pending[0]['ts'] if self.pending else 0.0,
+                'errors': self.errors,
+            }
+    
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+    
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            self.poll()
+
 def repl(db: Database):
     parser = SQLParser(db)
     print("=" * 50)
@@ -4,7 +4,22 @@ Test script demonstrating RDBMS functionality
 Run this to verify all features work correctly
 """
 
-from rdbms import Database, SQLParser
+import os
+import time
+import tempfile
+import threading
+import multiprocessing
+
+from rdbms import Database, SQLParser, Replica
+
+def follow_primary(snapshot_path, log_path, target_lsn, results):
+    replica = Replica(snapshot_path, log_path, poll_interval=0.01)
+    replica.start()
+    deadline = time.time() + 10
+    while replica.lag()['applied_lsn'] < target_lsn and time.time() < deadline:
+        time.sleep(0.01)
+    replica.stop()
+    results.put((replica.lag(), replica.parse_and_execute("SELECT name FROM users WHERE id=6")))
 
 def test_rdbms():
     print("=" * 60)
@@ -78,6 +93,8 @@ def test_rdbms():
         parser.parse_and_execute("UPDATE users SET age=26 WHERE id=1")
         result = parser.parse_and_execute("SELECT name, age FROM users WHERE id=1")
         print(f"✓ UPDATE successful: {result[0]}")
+        assert [row['id'] for row in parser.parse_and_execute("SELECT id FROM users")] == [1, 2, 3]
+        print("✓ Updated rows keep their position")
     except Exception as e:
         print(f"✗ Error: {e}")
         return
@@ -143,6 +160,293 @@ def test_rdbms():
         print(f"✗ Error: {e}")
         return
     
+    # Test 10: Materialized views
+    print("\n[TEST 10] Testing materialized views...")
+    try:
+        parser.parse_and_execute(
+            "CREATE MATERIALIZED VIEW user_posts AS SELECT users.name, posts.title FROM users JOIN posts ON users.id=posts.user_id"
+        )
+        parser.parse_and_execute(
+            "CREATE MATERIALIZED VIEW post_stats AS SELECT user_id, COUNT(*), SUM(views) FROM posts GROUP BY user_id"
+        )
+        parser.parse_and_execute("INSERT INTO posts (id, user_id, title, views) VALUES (4, 3, 'Charlie Post', 10)")
+        parser.parse_and_execute("UPDATE posts SET views=300 WHERE id=3")
+        
+        result = parser.parse_and_execute("SELECT * FROM user_posts")
+        expected = parser.parse_and_execute(
+            "SELECT users.name, posts.title FROM users JOIN posts ON users.id=posts.user_id"
+        )
+        assert sorted(map(str, result)) == sorted(map(str, expected))
+        print(f"✓ Join view maintained incrementally: {len(result)} rows")
+        
+        result = parser.parse_and_execute("SELECT * FROM post_stats WHERE user_id=2")
+        assert result == [{'user_id': 2, 'COUNT(*)': 1, 'SUM(views)': 300}]
+        print(f"✓ Aggregate view lookup: {result[0]}")
+        
+        parser.parse_and_execute("DELETE FROM posts WHERE user_id=3")
+        assert parser.parse_and_execute("SELECT * FROM post_stats WHERE user_id=3") == []
+        print("✓ Deletes propagated to views")
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return
+    
+    try:
+        parser.parse_and_execute("DELETE FROM user_posts")
+        print("✗ Materialized view accepted a direct write")
+    except ValueError as e:
+        print(f"✓ Materialized views are read-only: {e}")
+    
+    try:
+        parser.parse_and_execute(
+            "CREATE MATERIALIZED VIEW bad_view AS SELECT users.name, title FROM users JOIN posts ON users.id=posts.user_id"
+        )
+        print("✗ Materialized view accepted an unqualified join column")
+    except ValueError as e:
+        print(f"✓ Unresolved view columns rejected: {e}")
+    
+    try:
+        parser.parse_and_execute("CREATE MATERIALIZED VIEW bad_view AS SELECT name FROM users WHERE id IN (1)")
+        print("✗ Materialized view accepted a WHERE it can't evaluate")
+    except ValueError as e:
+        print(f"✓ Unsupported view WHERE rejected: {e}")
+    
+    try:
+        parser.parse_and_execute("CREATE MATERIALIZED VIEW bad_view AS SELECT SUM(name) FROM users")
+        print("✗ Materialized view accepted SUM over a VARCHAR column")
+    except ValueError as e:
+        print(f"✓ Non-numeric SUM/AVG rejected: {e}")
+    
+    # Test 11: Query result cache
+    print("\n[TEST 11] Testing query result cache...")
+    try:
+        cached_parser = SQLParser(db, cache_bytes=64 * 1024)
+        first = cached_parser.parse_and_execute("SELECT * FROM users WHERE id=?", (2,))
+        second = cached_parser.parse_and_execute("SELECT  *  FROM users  WHERE id=?", (2,))
+        assert first == second
+        assert cached_parser.cache_stats()['hits'] == 1
+        print(f"✓ Repeated SELECT served from cache: {cached_parser.cache_stats()['hit_rate']:.0%} hit rate")
+        
+        cached_parser.parse_and_execute("UPDATE users SET age=31 WHERE id=2")
+        result = cached_parser.parse_and_execute("SELECT * FROM users WHERE id=?", (2,))
+        assert result[0]['age'] == 31
+        print("✓ Cache invalidated by table version after UPDATE")
+        
+        cached_parser.parse_and_execute("SELECT * FROM users WHERE age=?", (31.0,))
+        expected = parser.parse_and_execute("SELECT * FROM users WHERE age=31")
+        assert cached_parser.parse_and_execute("SELECT * FROM users WHERE age=?", (31,)) == expected
+        print("✓ Equal parameters of different types (31, 31.0) are cached separately")
+        
+        tiny_parser = SQLParser(db, cache_bytes=1024)
+        for user_id in (1, 2, 3, 1, 2, 3):
+            tiny_parser.parse_and_execute("SELECT * FROM users WHERE id=?", (user_id,))
+        stats = tiny_parser.cache_stats()
+        assert stats['bytes'] <= stats['max_bytes'] and stats['evictions'] > 0
+        print(f"✓ Cache bounded at {stats['max_bytes']} bytes, {stats['evictions']} evictions")
+
+        errors = []
+        def poll_users():
+            try:
+                for i in range(300):
+                    tiny_parser.parse_and_execute("SELECT * FROM users WHERE id=?", (i % 3 + 1,))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=poll_users) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+        print("✓ Cache shared safely by 8 threads")
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return
+    
+    # Test 12: Foreign keys
+    print("\n[TEST 12] Testing foreign keys...")
+    try:
+        parser.parse_and_execute("""
+            CREATE TABLE comments (
+                id INT PRIMARY KEY,
+                post_id INT NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+                user_id INT REFERENCES users(id),
+                body VARCHAR(200)
+            )
+        """)
+        comments_table = db.get_table('comments')
+        assert 'post_id' in comments_table.indexes and 'user_id' in comments_table.indexes
+        print("✓ Referencing columns indexed automatically")
+        
+        parser.parse_and_execute("INSERT INTO comments (id, post_id, user_id, body) VALUES (1, 1, 2, 'Nice')")
+        parser.parse_and_execute("INSERT INTO comments (id, post_id, user_id, body) VALUES (2, 1, 3, 'Agreed')")
+        parser.parse_and_execute("DELETE FROM posts WHERE id=1")
+        assert parser.parse_and_execute("SELECT * FROM comments") == []
+        print("✓ ON DELETE CASCADE removed dependent rows")
+        
+        parser.parse_and_execute("CREATE TABLE tags (id INT PRIMARY KEY, post_id INT, tag VARCHAR(20))")
+        parser.parse_and_execute("INSERT INTO tags (id, post_id, tag) VALUES (1, 42, 'orphan')")
+        alter = "ALTER TABLE tags ADD FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE"
+        try:
+            parser.parse_and_execute(alter)
+            raise AssertionError("ALTER TABLE accepted an orphan row")
+        except ValueError:
+            pass
+        parser.parse_and_execute("DELETE FROM tags WHERE id=1")
+        parser.parse_and_execute(alter)
+        assert 'post_id' in db.get_table('tags').indexes
+        print("✓ ALTER TABLE ADD FOREIGN KEY checks existing rows")
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return
+    
+    try:
+        parser.parse_and_execute("INSERT INTO comments (id, post_id, user_id, body) VALUES (3, 99, 1, 'Orphan')")
+        print("✗ FOREIGN KEY constraint failed to prevent orphan row")
+    except ValueError as e:
+        print(f"✓ FOREIGN KEY constraint working: {e}")
+    
+    try:
+        parser.parse_and_execute("INSERT INTO comments (id, post_id, user_id, body) VALUES (3, 3, 3, 'Hi')")
+        parser.parse_and_execute("DELETE FROM users WHERE id=3")
+        print("✗ ON DELETE RESTRICT failed to block delete")
+    except ValueError as e:
+        print(f"✓ ON DELETE RESTRICT working: {e}")
+    
+    try:
+        parser.parse_and_execute("CREATE TABLE bad (id INT PRIMARY KEY, a INT REFERENCES users(id), b INT REFERENCES nosuch(id))")
+        print("✗ CREATE TABLE accepted a reference to a missing table")
+    except ValueError as e:
+        assert all(child.name != 'bad' for child, _, _, _ in db.get_table('users').referenced_by)
+        print(f"✓ Failed CREATE TABLE left no references behind: {e}")
+    
+    # Partition files and replication logs go to a scratch directory that is removed on exit
+    scratch = tempfile.TemporaryDirectory()
+    scratch_db = os.path.join(scratch.name, 'test_database.db')
+    
+    # Test 13: Partitioning
+    print("\n[TEST 13] Testing partitioned tables...")
+    try:
+        parser.parse_and_execute("""
+            CREATE TABLE events (
+                id INT PRIMARY KEY,
+                day INT NOT NULL,
+                name VARCHAR(50)
+            ) PARTITION BY RANGE (day) BOUNDS (10, 20)
+        """)
+        parser.parse_and_execute(
+            "CREATE TABLE sessions (id INT PRIMARY KEY, token VARCHAR(50)) PARTITION BY HASH (id) PARTITIONS 4"
+        )
+        for i in range(30):
+            parser.parse_and_execute(f"INSERT INTO events (id, day, name) VALUES ({i}, {i}, 'event{i}')")
+            parser.parse_and_execute(f"INSERT INTO sessions (id, token) VALUES ({i}, 'token{i}')")
+        events_table = db.get_table('events')
+        print(f"✓ RANGE partitions hold {[len(p.rows) for p in events_table.partitions]} rows")
+        
+        assert events_table._prune(parser._parse_where("day < 10")) == [0]
+        result = parser.parse_and_execute("SELECT * FROM events WHERE day >= 20")
+        assert len(result) == 10
+        print(f"✓ Pruned scan returned {len(result)} rows from partition 2 only")
+        
+        parser.parse_and_execute("UPDATE events SET day=25 WHERE id=5")
+        assert len(events_table.partitions[0].rows) == 9
+        assert parser.parse_and_execute("SELECT token FROM sessions WHERE id=7") == [{'token': 'token7'}]
+        print("✓ Rows move between partitions on UPDATE, HASH lookups hit one partition")
+        
+        db.save(scratch_db)
+        loaded_db = Database.load(scratch_db)
+        assert len(loaded_db.get_table('events').rows) == 30
+        events_table.create_index('name')
+        db.save(scratch_db)
+        loaded_db = Database.load(scratch_db)
+        assert all('name' in p.indexes for p in loaded_db.get_table('events').partitions)
+        print("✓ Partitions saved to and loaded from their own files")
+        
+        parser.parse_and_execute("DROP TABLE sessions")
+        parser.parse_and_execute("CREATE TABLE sessions (id INT PRIMARY KEY) PARTITION BY HASH (id) PARTITIONS 2")
+        db.save(scratch_db)
+        leftovers = sorted(f for f in os.listdir(scratch.name) if '.sessions.' in f)
+        assert leftovers == ['test_database.db.sessions.p0', 'test_database.db.sessions.p1'], leftovers
+        print("✓ Unused partition files removed on save")
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return
+    
+    # Test 14: Lazy loading
+    print("\n[TEST 14] Testing lazy load...")
+    try:
+        db.save(scratch_db)
+        lazy_db = Database.load(scratch_db, lazy=True)
+        assert lazy_db.load_stats['tables'] == {}
+        print(f"✓ Catalog opened in {lazy_db.load_stats['catalog_seconds'] * 1000:.2f} ms, no table data read")
+        
+        lazy_parser = SQLParser(lazy_db)
+        result = lazy_parser.parse_and_execute("SELECT * FROM users WHERE id=1")
+        assert result[0]['name'] == 'Alice'
+        assert list(lazy_db.load_stats['tables']) == ['users']
+        print("✓ First query read only the users table")
+        
+        lazy_parser.parse_and_execute("INSERT INTO users (id, name, email, age) VALUES (5, 'Eve', 'eve@test.com', 22)")
+        lazy_db.save(scratch_db)
+        reloaded = Database.load(scratch_db, use_mmap=True)
+        assert len(reloaded.get_table('users').rows) == 4
+        assert len(reloaded.get_table('posts').rows) == len(db.get_table('posts').rows)
+        print("✓ Saving a partly loaded database keeps the untouched tables")
+
+        lazy_db = Database.load(scratch_db, lazy=True)
+        SQLParser(reloaded).parse_and_execute("INSERT INTO users (id, name, email, age) VALUES (7, 'Gus', 'gus@test.com', 50)")
+        reloaded.save(scratch_db)
+        assert SQLParser(lazy_db).parse_and_execute("SELECT * FROM posts") == parser.parse_and_execute("SELECT * FROM posts")
+        print("✓ Lazy tables still read the file they were opened from after another save")
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return
+    
+    # Test 15: Replication
+    print("\n[TEST 15] Testing replication...")
+    try:
+        log_path = os.path.join(scratch.name, 'test_replication.log')
+        db.enable_replication(log_path)
+        db.save(scratch_db)
+        
+        replica = Replica(scratch_db, log_path)
+        parser.parse_and_execute("INSERT INTO users (id, name, email, age) VALUES (6, 'Frank', 'frank@test.com', 40)")
+        parser.parse_and_execute("UPDATE users SET age=41 WHERE id=6")
+        assert replica.lag()['records_behind'] == 2
+        replica.poll()
+        assert replica.parse_and_execute("SELECT age FROM users WHERE id=6") == [{'age': 41}]
+        print(f"✓ Replica caught up to LSN {replica.lag()['applied_lsn']}")
+        
+        results = multiprocessing.Queue()
+        follower = multiprocessing.Process(
+            target=follow_primary, args=(scratch_db, log_path, db.lsn + 1, results)
+        )
+        follower.start()
+        parser.parse_and_execute("UPDATE users SET name='Franklin' WHERE id=6")
+        lag, result = results.get(timeout=10)
+        follower.join()
+        assert result == [{'name': 'Franklin'}] and lag['records_behind'] == 0
+        print(f"✓ Follower process applied the log, lag {lag['seconds_behind']:.3f}s")
+
+        behind = Replica(scratch_db, log_path)
+        db.save(scratch_db)
+        parser.parse_and_execute("UPDATE users SET age=42 WHERE id=6")
+        assert db.trim_log() == db.saved_lsn
+        assert db.change_log.last_lsn() == db.lsn
+        behind.poll()
+        replica.poll()
+        assert behind.db.lsn == replica.db.lsn == db.lsn
+        assert behind.parse_and_execute("SELECT age FROM users WHERE id=6") == [{'age': 42}]
+        assert replica.parse_and_execute("SELECT age FROM users WHERE id=6") == [{'age': 42}]
+        print("✓ Log trimmed to the last save; replicas behind it reload the snapshot")
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return
+    
+    try:
+        replica.parse_and_execute("DELETE FROM users WHERE id=6")
+        print("✗ Replica accepted a write")
+    except ValueError as e:
+        print(f"✓ Replicas are read-only: {e}")
+    
     print("\n" + "=" * 60)
     print("All tests passed! ✓")
     print("=" * 60)